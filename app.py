@@ -22,17 +22,17 @@ Pages:
 """
 
 import streamlit as st
-import io, os, base64, copy
+import io, os, base64, copy, json, hashlib
 from datetime import datetime, date, time as time_type
 
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
-from reportlab.lib.colors import HexColor, black, white
+from reportlab.lib.colors import HexColor
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
 from reportlab.platypus import (
-    BaseDocTemplate, Frame, PageTemplate, Table, TableStyle,
-    Paragraph, Spacer, Image, PageBreak, Flowable
+    BaseDocTemplate, Frame, PageTemplate, Table, LongTable, TableStyle,
+    Paragraph, Spacer, PageBreak, Flowable, NextPageTemplate
 )
 from reportlab.lib.utils import ImageReader
 from PIL import Image as PILImage
@@ -56,6 +56,11 @@ TEALLT   = HexColor("#E6F4F9")
 PW, PH = letter
 MG = 0.6 * inch
 CW = PW - 2 * MG  # usable content width ≈ 6.8"
+HDR_H = 0.7 * inch + 13.2  # canvas page header: logo box + padding, gap, navy rule
+TM, BM = 0.5 * inch, 0.55 * inch   # top / bottom page margins
+FRAME_H = PH - TM - BM
+RX = PW - MG       # right edge of the content area
+FOOT_Y = 0.36 * inch  # footer text baseline (rule sits at 0.5")
 
 
 # ─── STYLES ──────────────────────────────────────────────────────────────────
@@ -71,6 +76,7 @@ def _s():
     S['bb9'] = ParagraphStyle('bb9', fontName='Helvetica-Bold',  fontSize=9,   leading=12, textColor=BLK)
     S['bb8'] = ParagraphStyle('bb8', fontName='Helvetica-Bold',  fontSize=8,   leading=11, textColor=BLK)
     S['bb7'] = ParagraphStyle('bb7', fontName='Helvetica-Bold',  fontSize=7,   leading=9.5,textColor=BLK)
+    S['bb8r']= ParagraphStyle('bb8r',parent=S['bb8'], alignment=TA_RIGHT)
     # Navy bold (labels)
     S['lbl'] = ParagraphStyle('lbl', fontName='Helvetica-Bold',  fontSize=8,   leading=11, textColor=NAVY)
     S['lbl7']= ParagraphStyle('lbl7',fontName='Helvetica-Bold',  fontSize=7,   leading=9,  textColor=NAVY)
@@ -97,7 +103,12 @@ def _s():
     S['qd']   = ParagraphStyle('qd', fontName='Helvetica',       fontSize=7,   leading=9.5,textColor=BLK)
     return S
 
-ST = _s()
+
+@st.cache_resource(show_spinner=False)
+def _styles():
+    """Paragraph styles, built on first PDF build and shared across reruns."""
+    return _s()
+
 
 # ─── LAB CONSTANTS ───────────────────────────────────────────────────────────
 LAB = {
@@ -138,6 +149,52 @@ DEFINITIONS = [
 
 DISCLAIMER = "This report shall not be reproduced, except in full, without the written approval of KETOS INC."
 
+# Lab contact block: right-hand lines of the page header, and cover banner markup
+HDR_LINES = (LAB["entity"], LAB["addr"][0], LAB["addr"][1],
+             f'Tel: {LAB["phone"]} | {LAB["email"]}')
+COVER_LAB_INFO = (f'<font size="8"><b>{LAB["entity"]}</b></font><br/>'
+                  f'<font size="7" color="#4A5568">{LAB["addr"][0]}<br/>'
+                  f'{LAB["addr"][1]}<br/>'
+                  f'Tel: {LAB["phone"]}<br/>'
+                  f'{LAB["email"]}</font>')
+
+# Table row specs: (result key, default) per column, in display order
+SUMMARY_COLS = (("parameter",""), ("method",""), ("df","1"), ("mdl",""), ("pql",""),
+                ("result",""), ("unit","mg/L"))
+DETAIL_COLS  = (("parameter",""), ("method",""), ("df","1"), ("mdl",""), ("pql",""),
+                ("result",""), ("qualifier",""), ("unit","mg/L"),
+                ("analyzed_time",""), ("analyst",""), ("analytical_batch",""))
+MB_COLS      = (("parameter",""), ("mdl",""), ("pql",""), ("mb_conc","ND"), ("qualifier",""))
+LCS_COLS     = (("parameter",""), ("mdl",""), ("pql",""), ("spike_conc",""),
+                ("lcs_recovery",""), ("lcsd_recovery",""), ("rpd",""),
+                ("recovery_limits","80-120"), ("rpd_limits","20"), ("qualifier",""))
+# Receipt checklist answers; if none is filled in the checklist is not drawn
+RECEIPT_KEYS = ("coc_present", "coc_signed", "coc_agrees", "custody_seals_bottles",
+                "custody_seals_cooler", "cooler_good", "proper_container", "containers_intact",
+                "sufficient_volume", "within_holding_time", "temp_compliance", "temperature",
+                "voa_headspace", "ph_acceptable", "receipt_comments")
+LOGIN_COLS   = (("lab_sample_id",""), ("client_sample_id",""), ("date_sampled",""),
+                ("matrix","Water"), ("disposal_date",""))   # + tests requested
+
+# Table headers and column widths, paired with the row specs above
+SUMMARY_HDRS = ("Parameters", "Method", "DF", "MDL", "PQL", "Results", "Units")
+SUMMARY_CW   = (CW-4.5*inch, 1.0*inch, 0.45*inch, 0.75*inch, 0.75*inch, 0.85*inch, 0.7*inch)
+DETAIL_HDRS  = ("Parameters", "Analysis\nMethod", "DF", "MDL", "PQL",
+                "Results", "Q", "Units", "Analyzed", "Analyst", "Analytical\nBatch")
+DETAIL_CW    = (CW*0.17, CW*0.10, CW*0.04, CW*0.07, CW*0.07,
+                CW*0.09, CW*0.04, CW*0.06, CW*0.13, CW*0.06, CW*0.10)
+MB_HDRS      = ("Parameters", "MDL", "PQL", "Blank Result", "Qualifier")
+MB_CW        = (CW*0.35, CW*0.15, CW*0.15, CW*0.18, CW*0.17)
+LCS_HDRS     = ("Parameters", "MDL", "PQL", "Spike\nConc.", "LCS\n% Rec",
+                "LCSD\n% Rec", "RPD", "% Rec\nLimits", "%RPD\nLimit", "Qual")
+LCS_CW       = (CW*0.17, CW*0.08, CW*0.08, CW*0.09, CW*0.09,
+                CW*0.09, CW*0.08, CW*0.12, CW*0.10, CW*0.07)
+LOGIN_HDRS   = ("Lab Sample ID", "Client\nSample ID", "Collection\nDate/Time", "Matrix",
+                "Disposal\nDate", "Tests Requested")
+LOGIN_CW     = (CW*0.16, CW*0.15, CW*0.14, CW*0.08, CW*0.12, CW*0.35)
+# Label/value grid under each QC batch bar
+QC_INFO_CW   = (0.5*inch, 1.2*inch, 0.5*inch, 1.2*inch, 0.7*inch, 1.2*inch, 0.7*inch, CW-6*inch)
+
 
 # ─── HELPER FLOWABLES ────────────────────────────────────────────────────────
 class HLine(Flowable):
@@ -152,65 +209,108 @@ class HLine(Flowable):
         self.canv.line(0, 1, self.width, 1)
 
 
+class ReaderImage(Flowable):
+    """Image drawn from an already-decoded ImageReader (no re-read per use)."""
+    def __init__(self, rd, w, h, hAlign='LEFT'):
+        Flowable.__init__(self)
+        self.rd, self.width, self.height = rd, w, h
+        self.hAlign = hAlign
+    def draw(self):
+        self.canv.drawImage(self.rd, 0, 0, width=self.width, height=self.height, mask='auto')
+
+
 # ─── PDF BUILDER ─────────────────────────────────────────────────────────────
 class KelpCOA:
-    def __init__(self, d, logo_bytes=None, sig_bytes=None, coc_bytes=None):
+    def __init__(self, d, logo_bytes=None, sig_bytes=None, coc_bytes=None,
+                 include_coc_placeholder=False):
         self.d = d
         self.logo_bytes = logo_bytes
         self.sig_bytes = sig_bytes
         self.coc_bytes = coc_bytes
-        self._pg = [0]
+        # Without a CoC scan the CoC page is left out unless a placeholder is wanted
+        self.include_coc_placeholder = include_coc_placeholder
+        # Decode uploaded images once; readers and pixel sizes are reused per page
+        self._logo_rd = ImageReader(self._img_buf(logo_bytes)) if logo_bytes else None
+        self._sig_rd = ImageReader(self._img_buf(sig_bytes)) if sig_bytes else None
+        self._coc_rd = ImageReader(self._img_buf(coc_bytes)) if coc_bytes else None
+        self.ST = _styles()
         self._total = d.get("total_page_count", 12)
 
     def _img_buf(self, raw):
         b = io.BytesIO(raw); b.seek(0); b.name = 'img.png'; return b
 
+    def _fit(self, rd, mw, mh):
+        """Size (w, h) of image rd scaled to fit within mw x mh, aspect kept."""
+        iw, ih = rd.getSize(); s = min(mw/iw, mh/ih)
+        return iw*s, ih*s
+
     def _logo(self, mw=1.5*inch, mh=0.7*inch):
         if self.logo_bytes:
-            im = PILImage.open(io.BytesIO(self.logo_bytes))
-            iw, ih = im.size; s = min(mw/iw, mh/ih)
-            return Image(self._img_buf(self.logo_bytes), width=iw*s, height=ih*s)
+            return ReaderImage(self._logo_rd, *self._fit(self._logo_rd, mw, mh))
         return Paragraph('<font color="#1F4E79" size="15"><b>KETOS</b></font><br/>'
                          '<font color="#3A9ABF" size="6.5">ENVIRONMENTAL LAB SERVICES</font>',
                          ParagraphStyle('lgo', fontSize=15, leading=17))
 
-    # ── Page header: logo left, lab info right, title centered, thin rule ──
+    # ── Page header bar (pages 2+): logo left, lab info right, navy rule ──
+    # Drawn straight on the canvas by the 'body' page template; the frame
+    # below it is HDR_H shorter. logo = (ImageReader, w, h) or None.
+    def _draw_hdr(self, c, logo):
+        x0 = MG + 6                        # frame padding, to line up with flowables
+        x1 = x0 + CW
+        top = PH - TM - 6
+        yc = top - 0.7*inch - 3            # bottom of the logo box
+        c.saveState()
+        if logo:
+            rd, w, h = logo
+            c.drawImage(rd, x0, yc, width=w, height=h, mask='auto')
+        else:
+            c.setFont("Helvetica-Bold", 15); c.setFillColor(NAVY)
+            c.drawString(x0, yc + 23, "KETOS")
+            c.setFont("Helvetica", 6.5); c.setFillColor(TEAL)
+            c.drawString(x0, yc + 6, "ENVIRONMENTAL LAB SERVICES")
+        c.setFont("Helvetica", 7); c.setFillColor(DKGRAY)
+        for i, line in enumerate(HDR_LINES):
+            c.drawRightString(x1, yc + 31 - 9*i, line)
+        c.setStrokeColor(NAVY); c.setLineWidth(1.2)
+        c.line(x0, top - HDR_H + 2, x1, top - HDR_H + 2)
+        c.restoreState()
+
+    # ── Page footer (static part): rule and disclaimer; page number is per page ──
+    def _draw_ftr(self, c):
+        c.saveState()
+        c.setStrokeColor(BORDER); c.setLineWidth(0.4)
+        c.line(MG, 0.5*inch, RX, 0.5*inch)
+        c.setFont("Helvetica", 6); c.setFillColor(MDGRAY)
+        c.drawString(MG, FOOT_Y, DISCLAIMER)
+        c.restoreState()
+
+    # ── Page title: centered, thin rule (header bar is drawn by the template) ──
     def _hdr(self, title):
         items = []
-        # Top bar: logo + lab address
-        logo = self._logo()
-        addr = Paragraph(
-            f'<font size="7" color="#4A5568">{LAB["entity"]}<br/>'
-            f'{LAB["addr"][0]}<br/>{LAB["addr"][1]}<br/>'
-            f'Tel: {LAB["phone"]}  |  {LAB["email"]}</font>',
-            ParagraphStyle('addr', fontSize=7, leading=9, alignment=TA_RIGHT, textColor=DKGRAY))
-        bar = Table([[logo, addr]], colWidths=[CW*0.45, CW*0.55], hAlign='LEFT')
-        bar.setStyle(TableStyle([('VALIGN',(0,0),(-1,-1),'BOTTOM'),
-                                 ('LEFTPADDING',(0,0),(-1,-1),0),('RIGHTPADDING',(0,0),(-1,-1),0)]))
-        items.append(bar)
-        items.append(Spacer(1, 4))
-        items.append(HLine(CW, NAVY, 1.2))
         items.append(Spacer(1, 6))
-        items.append(Paragraph(title, ST['title']))
+        items.append(Paragraph(title, self.ST['title']))
         items.append(Spacer(1, 2))
         items.append(HLine(CW, LTGRAY, 0.4))
         items.append(Spacer(1, 8))
         return items
 
     # ── Data table with proper headers ──
-    def _tbl(self, hdrs, rows, cw, result_col=None):
-        """Professional data table: navy header, alternating rows, wrapping text."""
+    def _tbl(self, hdrs, rows, cw, result_col=None, long=False):
+        """Professional data table: navy header, alternating rows, wrapping text.
+        long=True switches to LongTable once there are enough rows to span pages."""
         # Normalize column widths to exactly fill CW
         total = sum(cw)
         if total > 0:
             cw = [w * CW / total for w in cw]
+        ST = self.ST
         data = [[Paragraph(h, ST['thl'] if i==0 else ST['th']) for i,h in enumerate(hdrs)]]
-        for row in rows:
-            data.append([
-                Paragraph(str(v) if v else '', ST['tdl'] if ci==0 else (ST['tdb'] if result_col and ci==result_col else ST['td']))
-                for ci, v in enumerate(row)])
+        # Cell style per column, picked once: first column left, result column bold
+        col_st = [ST['tdl'] if ci==0 else (ST['tdb'] if result_col and ci==result_col else ST['td'])
+                  for ci in range(len(hdrs))]
+        data += [[Paragraph(str(v) if v else '', cs) for v, cs in zip(row, col_st)] for row in rows]
 
-        t = Table(data, colWidths=cw, hAlign='LEFT', repeatRows=1)
+        tcls = LongTable if long and len(rows) > 50 else Table
+        t = tcls(data, colWidths=cw, hAlign='LEFT', repeatRows=1)
         cmds = [
             ('BACKGROUND', (0,0), (-1,0), HDRFILL),
             ('TEXTCOLOR',  (0,0), (-1,0), WHT),
@@ -223,38 +323,40 @@ class KelpCOA:
             ('LINEBELOW',  (0,-1),(-1,-1), 0.5, BORDER),
             ('LINEAFTER',  (0,0), (-2,-1), 0.2, HexColor("#E2E8F0")),
         ]
-        for i in range(1, len(data)):
-            if i % 2 == 0: cmds.append(('BACKGROUND',(0,i),(-1,i), ROWALT))
-            cmds.append(('LINEBELOW',(0,i),(-1,i), 0.2, LTGRAY))
+        if rows:
+            # One ranged command each instead of two per row
+            cmds += [('ROWBACKGROUNDS',(0,1),(-1,-1), [None, ROWALT]),
+                     ('LINEBELOW',     (0,1),(-1,-1), 0.2, LTGRAY)]
         t.setStyle(TableStyle(cmds))
         return t
 
     # ── Info grid (label-value pairs) ──
     def _info(self, pairs, cw=None):
         """pairs = [[(lbl,val),(lbl,val)], ...] — rows of pairs"""
-        data = []
-        for row in pairs:
-            r = []
-            for lbl, val in row:
-                r.append(Paragraph(f'<b>{lbl}</b>' if lbl else '', ST['lbl7']))
-                r.append(Paragraph(str(val), ST['val7']))
-            data.append(r)
+        vs = self.ST['val7']
+        # Labels stay plain text; styled by the FONT commands below
+        data = [[cell for lbl, val in row for cell in (lbl, Paragraph(str(val), vs))]
+                for row in pairs]
         nc = len(data[0]) if data else 4
         if cw is None:
             cw = [CW/nc] * nc
         t = Table(data, colWidths=cw, hAlign='LEFT')
-        t.setStyle(TableStyle([
+        cmds = [
             ('VALIGN',(0,0),(-1,-1),'TOP'),
             ('TOPPADDING',(0,0),(-1,-1),1.5),('BOTTOMPADDING',(0,0),(-1,-1),1.5),
             ('LEFTPADDING',(0,0),(-1,-1),0),('RIGHTPADDING',(0,0),(-1,-1),3),
-        ]))
+        ]
+        for c in range(0, nc, 2):
+            cmds.append(('FONT',(c,0),(c,-1), 'Helvetica-Bold', 7, 9))
+            cmds.append(('TEXTCOLOR',(c,0),(c,-1), NAVY))
+        t.setStyle(TableStyle(cmds))
         return t
 
     # ── Prep/Batch info bar (light blue strip) ──
     def _batchbar(self, items_dict):
         cells = []
         for k, v in items_dict.items():
-            cells.append(Paragraph(f'<b>{k}</b> {v}', ST['bb7']))
+            cells.append(Paragraph(f'<b>{k}</b> {v}', self.ST['bb7']))
         n = len(cells)
         t = Table([cells], colWidths=[CW/n]*n, hAlign='LEFT')
         t.setStyle(TableStyle([
@@ -267,26 +369,44 @@ class KelpCOA:
         return t
 
     # ── Build PDF ──
-    def build(self):
-        buf = io.BytesIO()
+    def build(self, out=None):
+        """Render the COA. Returns the PDF bytes, or, when out (a path or a
+        writable binary stream) is given, writes the PDF there and returns None."""
+        buf = io.BytesIO() if out is None else out
+        # invariant=1 pins the creation date / document ID so identical input
+        # yields byte-identical output (cacheable); compression stays on.
         doc = BaseDocTemplate(buf, pagesize=letter,
-            leftMargin=MG, rightMargin=MG, topMargin=0.5*inch, bottomMargin=0.55*inch,
-            title=f"KELP COA — WO {self.d.get('work_order','')}")
-        frame = Frame(MG, 0.55*inch, CW, PH - 0.5*inch - 0.55*inch, id='main')
-        pg = self._pg; total = self._total
+            leftMargin=MG, rightMargin=MG, topMargin=TM, bottomMargin=BM,
+            title=f"KELP COA — WO {self.d.get('work_order','')}",
+            pageCompression=1, invariant=1)
+        frame = Frame(MG, BM, CW, FRAME_H, id='main')
+        body = Frame(MG, BM, CW, FRAME_H - HDR_H, id='body')
+        total = self._total
+        logo = None
+        if self.logo_bytes:
+            logo = (self._logo_rd, *self._fit(self._logo_rd, 1.5*inch, 0.7*inch))
+        # Static header/footer parts go into form XObjects on first use;
+        # every page then just references them
+        def stamp(canvas, name, draw):
+            if not canvas.hasForm(name):
+                canvas.beginForm(name)
+                draw(canvas)
+                canvas.endForm()
+            canvas.doForm(name)
         def on_page(canvas, doc_):
-            pg[0] += 1
+            stamp(canvas, 'kelp_ftr', self._draw_ftr)
             canvas.saveState()
-            # Footer
-            canvas.setStrokeColor(BORDER); canvas.setLineWidth(0.4)
-            canvas.line(MG, 0.5*inch, PW-MG, 0.5*inch)
             canvas.setFont("Helvetica", 6); canvas.setFillColor(MDGRAY)
-            canvas.drawString(MG, 0.36*inch, DISCLAIMER)
-            canvas.drawRightString(PW-MG, 0.36*inch, f"Page {pg[0]} of {total}")
+            canvas.drawRightString(RX, FOOT_Y, f"Page {canvas.getPageNumber()} of {total}")
             canvas.restoreState()
-        doc.addPageTemplates([PageTemplate(id='all', frames=[frame], onPage=on_page)])
+        def on_body_page(canvas, doc_):
+            stamp(canvas, 'kelp_hdr', lambda c: self._draw_hdr(c, logo))
+            on_page(canvas, doc_)
+        doc.addPageTemplates([PageTemplate(id='cover', frames=[frame], onPage=on_page),
+                              PageTemplate(id='body', frames=[body], onPage=on_body_page)])
 
         story = self._pg_cover()
+        story.append(NextPageTemplate('body'))
         story.append(PageBreak())
         story += self._pg_narrative()
         story.append(PageBreak())
@@ -304,10 +424,11 @@ class KelpCOA:
         story += self._pg_receipt()
         story.append(PageBreak())
         story += self._pg_login()
-        story.append(PageBreak())
-        story += self._pg_coc()
+        if self.coc_bytes or self.include_coc_placeholder:
+            story.append(PageBreak())
+            story += self._pg_coc()
         doc.build(story)
-        return buf.getvalue()
+        return buf.getvalue() if out is None else None
 
     # ═══════════════════════════════════════════════════════════════════════════
     # PAGE 1: COVER LETTER
@@ -318,12 +439,7 @@ class KelpCOA:
 
         # ── Top banner: Logo left | Lab info right (like Pace Analytical) ──
         logo = self._logo(mw=1.8*inch, mh=0.8*inch)
-        lab_info = Paragraph(
-            f'<font size="8"><b>{LAB["entity"]}</b></font><br/>'
-            f'<font size="7" color="#4A5568">{LAB["addr"][0]}<br/>'
-            f'{LAB["addr"][1]}<br/>'
-            f'Tel: {LAB["phone"]}<br/>'
-            f'{LAB["email"]}</font>',
+        lab_info = Paragraph(COVER_LAB_INFO,
             ParagraphStyle('labaddr', fontSize=7, leading=9.5, alignment=TA_RIGHT, textColor=DKGRAY))
         banner = Table([[logo, lab_info]], colWidths=[CW*0.5, CW*0.5], hAlign='LEFT')
         banner.setStyle(TableStyle([
@@ -337,32 +453,31 @@ class KelpCOA:
 
         # ── Date ──
         rpt_date = self.d.get('report_date','')
-        s.append(Paragraph(str(rpt_date), ST['b9']))
+        s.append(Paragraph(str(rpt_date), self.ST['b9']))
         s.append(Spacer(1, 18))
 
-        # ── Recipient block ──
+        # ── Recipient block: one paragraph, a line per non-empty field ──
         contact = self.d.get('client_contact','')
-        company = self.d.get('client_company','')
-        addr = self.d.get('client_address','')
-        csz = self.d.get('client_city_state_zip','')
-        for line in [contact, company, addr, csz]:
-            if line:
-                s.append(Paragraph(line, ST['b9']))
+        recipient = '<br/>'.join(line for line in (
+            contact, self.d.get('client_company',''),
+            self.d.get('client_address',''), self.d.get('client_city_state_zip','')) if line)
+        if recipient:
+            s.append(Paragraph(recipient, self.ST['b9']))
         s.append(Spacer(1, 18))
 
         # ── RE block ──
         proj = self.d.get('project_name','')
         wo = self.d.get('work_order','')
-        re_style = ParagraphStyle('re', parent=ST['b9'], leftIndent=36)
-        s.append(Paragraph(f'RE:&nbsp;&nbsp;&nbsp;Project: &nbsp;<b>{proj}</b>', ST['b9']))
-        s.append(Paragraph(f'&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;KELP Work Order No.: &nbsp;<b>{wo}</b>', ST['b9']))
+        s.append(Paragraph(f'RE:&nbsp;&nbsp;&nbsp;Project: &nbsp;<b>{proj}</b><br/>'
+                           f'&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;KELP Work Order No.: &nbsp;<b>{wo}</b>',
+                           self.ST['b9']))
         s.append(Spacer(1, 18))
 
         # ── Salutation + body ──
-        s.append(Paragraph(f"Dear {contact}:", ST['b9']))
+        s.append(Paragraph(f"Dear {contact}:", self.ST['b9']))
         s.append(Spacer(1, 10))
 
-        body_s = ParagraphStyle('cbody', parent=ST['b9'], fontSize=9.5, leading=14.5,
+        body_s = ParagraphStyle('cbody', parent=self.ST['b9'], fontSize=9.5, leading=14.5,
                                  alignment=TA_JUSTIFY, spaceBefore=4, spaceAfter=6)
         recv = self.d.get('date_received_text','')
         elap = self.d.get('elap_number','XXXX')
@@ -379,32 +494,26 @@ class KelpCOA:
         s.append(Spacer(1, 24))
 
         # ── Signature block: "Sincerely," then sig image then name/title ──
-        s.append(Paragraph("Sincerely,", ST['b9']))
+        s.append(Paragraph("Sincerely,", self.ST['b9']))
         s.append(Spacer(1, 4))
         if self.sig_bytes:
             # Constrain signature to reasonable size and left-align
-            im = PILImage.open(io.BytesIO(self.sig_bytes))
-            iw, ih = im.size
-            max_w, max_h = 1.8*inch, 0.55*inch
-            scale = min(max_w / iw, max_h / ih)
-            sig_w, sig_h = iw * scale, ih * scale
-            sig_img = Image(self._img_buf(self.sig_bytes), width=sig_w, height=sig_h)
-            sig_img.hAlign = 'LEFT'
-            s.append(sig_img)
+            sig_w, sig_h = self._fit(self._sig_rd, 1.8*inch, 0.55*inch)
+            s.append(ReaderImage(self._sig_rd, sig_w, sig_h))
         else:
             s.append(Spacer(1, 30))
         s.append(Spacer(1, 2))
         s.append(HLine(2.4*inch, NAVY, 0.5))
         s.append(Spacer(1, 2))
-        s.append(Paragraph(f"<b>{self.d.get('approver_name','')}</b>", ST['bb9']))
-        s.append(Paragraph(self.d.get('approver_title',''), ST['b8']))
-        s.append(Paragraph(str(self.d.get('approval_date','')), ST['b8']))
+        s.append(Paragraph(f"<b>{self.d.get('approver_name','')}</b>", self.ST['bb9']))
+        s.append(Paragraph(self.d.get('approver_title',''), self.ST['b8']))
+        s.append(Paragraph(str(self.d.get('approval_date','')), self.ST['b8']))
 
         # ── Bottom: Disclaimer + accreditation ──
          #s.append(Spacer(1, 30))
         # s.append(HLine(CW, LTGRAY, 0.3))
         # s.append(Spacer(1, 4))
-        # disc_s = ParagraphStyle('disc2', parent=ST['b7'], textColor=MDGRAY, alignment=TA_CENTER)
+        # disc_s = ParagraphStyle('disc2', parent=self.ST['b7'], textColor=MDGRAY, alignment=TA_CENTER)
         # s.append(Paragraph(DISCLAIMER, disc_s))
         return s
 
@@ -422,7 +531,7 @@ class KelpCOA:
         s.append(HLine(CW, LTGRAY, 0.4))
         s.append(Spacer(1, 10))
 
-        bs = ParagraphStyle('nb', parent=ST['b9'], spaceBefore=6, spaceAfter=4, leftIndent=4, rightIndent=4)
+        bs = ParagraphStyle('nb', parent=self.ST['b9'], spaceBefore=6, spaceAfter=4, leftIndent=4, rightIndent=4)
         custom = self.d.get('case_narrative_custom','')
         if custom:
             s.append(Paragraph(custom, bs))
@@ -453,30 +562,28 @@ class KelpCOA:
         ], cw=[1.3*inch, 2.2*inch, 1.1*inch, CW-4.6*inch]))
         s.append(Spacer(1, 10))
 
+        # Sample sub-header: one style shared by every sample's bar
+        sh_cw = [CW*0.5, CW*0.5]
+        sh_style = TableStyle([
+            ('BACKGROUND',(0,0),(-1,0), TEALLT),
+            ('BOX',(0,0),(-1,0), 0.4, BORDER),
+            ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
+            ('TOPPADDING',(0,0),(-1,-1),3),('BOTTOMPADDING',(0,0),(-1,-1),3),
+            ('LEFTPADDING',(0,0),(-1,-1),5),('RIGHTPADDING',(0,0),(-1,-1),5),
+        ])
         for samp in self.d.get('samples', []):
-            # Sample sub-header
             csid = samp.get('client_sample_id','')
             lsid = samp.get('lab_sample_id','')
             sh = Table([[
-                Paragraph(f'<b>Sample:</b> {csid}', ST['bb8']),
-                Paragraph(f'<b>Lab ID:</b> {lsid}', ParagraphStyle('r', parent=ST['bb8'], alignment=TA_RIGHT)),
-            ]], colWidths=[CW*0.5, CW*0.5], hAlign='LEFT')
-            sh.setStyle(TableStyle([
-                ('BACKGROUND',(0,0),(-1,0), TEALLT),
-                ('BOX',(0,0),(-1,0), 0.4, BORDER),
-                ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
-                ('TOPPADDING',(0,0),(-1,-1),3),('BOTTOMPADDING',(0,0),(-1,-1),3),
-                ('LEFTPADDING',(0,0),(-1,-1),5),('RIGHTPADDING',(0,0),(-1,-1),5),
-            ]))
+                Paragraph(f'<b>Sample:</b> {csid}', self.ST['bb8']),
+                Paragraph(f'<b>Lab ID:</b> {lsid}', self.ST['bb8r']),
+            ]], colWidths=sh_cw, hAlign='LEFT')
+            sh.setStyle(sh_style)
             s.append(sh)
             s.append(Spacer(1, 2))
 
-            hdrs = ["Parameters", "Method", "DF", "MDL", "PQL", "Results", "Units"]
-            cw = [CW-4.5*inch, 1.0*inch, 0.45*inch, 0.75*inch, 0.75*inch, 0.85*inch, 0.7*inch]
-            rows = [[r.get('parameter',''), r.get('method',''), r.get('df','1'),
-                      r.get('mdl',''), r.get('pql',''), r.get('result',''), r.get('unit','mg/L')]
-                     for r in samp.get('results',[])]
-            s.append(self._tbl(hdrs, rows, cw, result_col=5))
+            rows = [[r.get(k, dv) for k, dv in SUMMARY_COLS] for r in samp.get('results',[])]
+            s.append(self._tbl(SUMMARY_HDRS, rows, SUMMARY_CW, result_col=5, long=True))
             s.append(Spacer(1, 10))
         return s
 
@@ -494,11 +601,11 @@ class KelpCOA:
         recv = self.d.get('date_received_text','')
 
         info_bar = Table([[
-            Paragraph(f'<b>Sample:</b> {csid}', ST['bb7']),
-            Paragraph(f'<b>Lab ID:</b> {lsid}', ST['bb7']),
-            Paragraph(f'<b>Collected:</b> {ds}', ST['bb7']),
-            Paragraph(f'<b>Received:</b> {recv}', ST['bb7']),
-            Paragraph(f'<b>Matrix:</b> {mx}', ST['bb7']),
+            Paragraph(f'<b>Sample:</b> {csid}', self.ST['bb7']),
+            Paragraph(f'<b>Lab ID:</b> {lsid}', self.ST['bb7']),
+            Paragraph(f'<b>Collected:</b> {ds}', self.ST['bb7']),
+            Paragraph(f'<b>Received:</b> {recv}', self.ST['bb7']),
+            Paragraph(f'<b>Matrix:</b> {mx}', self.ST['bb7']),
         ]], colWidths=[CW*0.22, CW*0.22, CW*0.22, CW*0.18, CW*0.16], hAlign='LEFT')
         info_bar.setStyle(TableStyle([
             ('BACKGROUND',(0,0),(-1,0), ACCENT),
@@ -524,19 +631,8 @@ class KelpCOA:
             }))
             s.append(Spacer(1, 2))
 
-            hdrs = ["Parameters", "Analysis\nMethod", "DF", "MDL", "PQL",
-                     "Results", "Q", "Units", "Analyzed", "Analyst", "Analytical\nBatch"]
-            cw = [CW*0.17, CW*0.10, CW*0.04, CW*0.07, CW*0.07,
-                  CW*0.09, CW*0.04, CW*0.06, CW*0.13, CW*0.06, CW*0.10]
-            rows = []
-            for r in pg.get('results',[]):
-                rows.append([
-                    r.get('parameter',''), r.get('method',''), r.get('df','1'),
-                    r.get('mdl',''), r.get('pql',''), r.get('result',''),
-                    r.get('qualifier',''), r.get('unit','mg/L'),
-                    r.get('analyzed_time',''), r.get('analyst',''), r.get('analytical_batch',''),
-                ])
-            s.append(self._tbl(hdrs, rows, cw, result_col=5))
+            rows = [[r.get(k, dv) for k, dv in DETAIL_COLS] for r in pg.get('results',[])]
+            s.append(self._tbl(DETAIL_HDRS, rows, DETAIL_CW, result_col=5, long=True))
             s.append(Spacer(1, 10))
 
         return s
@@ -556,15 +652,11 @@ class KelpCOA:
             s.append(self._info([
                 [("Matrix:", mb.get('matrix','Water')), ("Units:", mb.get('units','mg/L')),
                  ("Prep Date:", mb.get('prep_date','')), ("Analyzed:", mb.get('analyzed_date',''))],
-            ], cw=[0.5*inch, 1.2*inch, 0.5*inch, 1.2*inch, 0.7*inch, 1.2*inch, 0.7*inch, CW-6*inch]))
+            ], cw=QC_INFO_CW))
             s.append(Spacer(1, 4))
 
-            hdrs = ["Parameters", "MDL", "PQL", "Blank Result", "Qualifier"]
-            cw = [CW*0.35, CW*0.15, CW*0.15, CW*0.18, CW*0.17]
-            rows = [[r.get('parameter',''), r.get('mdl',''), r.get('pql',''),
-                      r.get('mb_conc','ND'), r.get('qualifier','')]
-                     for r in mb.get('results',[])]
-            s.append(self._tbl(hdrs, rows, cw))
+            rows = [[r.get(k, dv) for k, dv in MB_COLS] for r in mb.get('results',[])]
+            s.append(self._tbl(MB_HDRS, rows, MB_CW))
             s.append(Spacer(1, 14))
         return s
 
@@ -573,7 +665,7 @@ class KelpCOA:
     # ═══════════════════════════════════════════════════════════════════════════
     def _pg_qc_lcs(self):
         s = self._hdr("QUALITY CONTROL DATA — LCS/LCSD")
-        s.append(Paragraph("Raw values are used in quality control assessment.", ST['ital']))
+        s.append(Paragraph("Raw values are used in quality control assessment.", self.ST['ital']))
         s.append(Spacer(1, 6))
 
         for lcs in self.d.get('lcs_batches',[]):
@@ -586,22 +678,11 @@ class KelpCOA:
             s.append(self._info([
                 [("Matrix:", lcs.get('matrix','Water')), ("Units:", lcs.get('units','mg/L')),
                  ("Prep Date:", lcs.get('prep_date','')), ("Analyzed:", lcs.get('analyzed_date',''))],
-            ], cw=[0.5*inch, 1.2*inch, 0.5*inch, 1.2*inch, 0.7*inch, 1.2*inch, 0.7*inch, CW-6*inch]))
+            ], cw=QC_INFO_CW))
             s.append(Spacer(1, 4))
 
-            hdrs = ["Parameters", "MDL", "PQL", "Spike\nConc.", "LCS\n% Rec",
-                     "LCSD\n% Rec", "RPD", "% Rec\nLimits", "%RPD\nLimit", "Qual"]
-            cw = [CW*0.17, CW*0.08, CW*0.08, CW*0.09, CW*0.09,
-                  CW*0.09, CW*0.08, CW*0.12, CW*0.10, CW*0.07]
-            rows = []
-            for r in lcs.get('results',[]):
-                rows.append([
-                    r.get('parameter',''), r.get('mdl',''), r.get('pql',''),
-                    r.get('spike_conc',''), r.get('lcs_recovery',''),
-                    r.get('lcsd_recovery',''), r.get('rpd',''),
-                    r.get('recovery_limits','80-120'), r.get('rpd_limits','20'), r.get('qualifier',''),
-                ])
-            s.append(self._tbl(hdrs, rows, cw))
+            rows = [[r.get(k, dv) for k, dv in LCS_COLS] for r in lcs.get('results',[])]
+            s.append(self._tbl(LCS_HDRS, rows, LCS_CW))
             s.append(Spacer(1, 14))
         return s
 
@@ -611,18 +692,18 @@ class KelpCOA:
     def _pg_qualifiers(self):
         s = self._hdr("QUALIFIERS AND DEFINITIONS")
 
-        s.append(Paragraph('<b>DEFINITIONS</b>', ST['sect']))
+        s.append(Paragraph('<b>DEFINITIONS</b>', self.ST['sect']))
         s.append(HLine(CW, NAVY, 0.4))
         s.append(Spacer(1, 4))
         for d in DEFINITIONS:
-            s.append(Paragraph(d, ParagraphStyle('def', parent=ST['b7'], spaceBefore=1.5, spaceAfter=1.5, leftIndent=6)))
+            s.append(Paragraph(d, ParagraphStyle('def', parent=self.ST['b7'], spaceBefore=1.5, spaceAfter=1.5, leftIndent=6)))
         s.append(Spacer(1, 10))
 
-        s.append(Paragraph('<b>ANALYTE QUALIFIERS</b>', ST['sect']))
+        s.append(Paragraph('<b>ANALYTE QUALIFIERS</b>', self.ST['sect']))
         s.append(HLine(CW, NAVY, 0.4))
         s.append(Spacer(1, 4))
 
-        qdata = [[Paragraph(f'<b>{c}</b>', ST['qc']), Paragraph(f'— {d}', ST['qd'])] for c, d in QUALIFIERS]
+        qdata = [[Paragraph(f'<b>{c}</b>', self.ST['qc']), Paragraph(f'— {d}', self.ST['qd'])] for c, d in QUALIFIERS]
         qt = Table(qdata, colWidths=[0.4*inch, CW-0.4*inch-8], hAlign='LEFT')
         qt.setStyle(TableStyle([
             ('VALIGN',(0,0),(-1,-1),'TOP'),
@@ -650,6 +731,9 @@ class KelpCOA:
              ("Carrier:", rc.get('carrier_name',''))],
         ], cw=[0.8*inch, 2*inch, 1.3*inch, CW-4.1*inch]))
         s.append(Spacer(1, 8))
+        if not any(rc.get(k) for k in RECEIPT_KEYS):
+            s.append(Paragraph("No sample receipt data recorded.", self.ST['b8']))
+            return s
 
         sections = [
             ("Chain of Custody (COC) Information", [
@@ -672,22 +756,27 @@ class KelpCOA:
                 ("Water-pH acceptable upon receipt?", rc.get("ph_acceptable","")),
             ]),
         ]
+        # Section heading style, checklist layout and cell styles are the same for every section
+        sh_s = ParagraphStyle('sh', parent=self.ST['sect'], spaceBefore=6, spaceAfter=2)
+        q_s, a_s = self.ST['b8'], self.ST['bb8']
+        ck_cw = [3.8*inch, CW-3.8*inch]
+        ck_style = TableStyle([
+            ('VALIGN',(0,0),(-1,-1),'TOP'),
+            ('TOPPADDING',(0,0),(-1,-1),2),('BOTTOMPADDING',(0,0),(-1,-1),2),
+            ('LEFTPADDING',(0,0),(0,-1),10),('LEFTPADDING',(1,0),(1,-1),6),
+            ('LINEBELOW',(0,0),(-1,-2), 0.15, LTGRAY),
+        ])
         for title, items in sections:
-            s.append(Paragraph(f'<b>{title}</b>', ParagraphStyle('sh', parent=ST['sect'], spaceBefore=6, spaceAfter=2)))
+            s.append(Paragraph(f'<b>{title}</b>', sh_s))
             s.append(HLine(CW, LTGRAY, 0.3))
             s.append(Spacer(1, 2))
-            data = [[Paragraph(q, ST['b8']), Paragraph(str(a), ST['bb8'])] for q, a in items]
-            ct = Table(data, colWidths=[3.8*inch, CW-3.8*inch], hAlign='LEFT')
-            ct.setStyle(TableStyle([
-                ('VALIGN',(0,0),(-1,-1),'TOP'),
-                ('TOPPADDING',(0,0),(-1,-1),2),('BOTTOMPADDING',(0,0),(-1,-1),2),
-                ('LEFTPADDING',(0,0),(0,-1),10),('LEFTPADDING',(1,0),(1,-1),6),
-                ('LINEBELOW',(0,0),(-1,-2), 0.15, LTGRAY),
-            ]))
+            data = [[Paragraph(q, q_s), Paragraph(str(a), a_s)] for q, a in items]
+            ct = Table(data, colWidths=ck_cw, hAlign='LEFT')
+            ct.setStyle(ck_style)
             s.append(ct)
 
         s.append(Spacer(1, 8))
-        s.append(Paragraph(f'<b>Comments:</b> {rc.get("receipt_comments","")}', ST['b8']))
+        s.append(Paragraph(f'<b>Comments:</b> {rc.get("receipt_comments","")}', self.ST['b8']))
         return s
 
     # ═══════════════════════════════════════════════════════════════════════════
@@ -706,18 +795,10 @@ class KelpCOA:
         s.append(HLine(CW, NAVY, 0.4))
         s.append(Spacer(1, 6))
 
-        hdrs = ["Lab Sample ID", "Client\nSample ID", "Collection\nDate/Time", "Matrix",
-                 "Disposal\nDate", "Tests Requested"]
-        cw = [CW*0.16, CW*0.15, CW*0.14, CW*0.08, CW*0.12, CW*0.35]
-        rows = []
-        for samp in self.d.get('samples',[]):
-            tests = ", ".join([pg.get('analytical_method','') for pg in samp.get('prep_groups',[])])
-            rows.append([
-                samp.get('lab_sample_id',''), samp.get('client_sample_id',''),
-                samp.get('date_sampled',''), samp.get('matrix','Water'),
-                samp.get('disposal_date',''), tests,
-            ])
-        s.append(self._tbl(hdrs, rows, cw))
+        rows = [[samp.get(k, dv) for k, dv in LOGIN_COLS]
+                + [", ".join(pg.get('analytical_method','') for pg in samp.get('prep_groups',()))]
+                for samp in self.d.get('samples',[])]
+        s.append(self._tbl(LOGIN_HDRS, rows, LOGIN_CW))
         return s
 
     # ═══════════════════════════════════════════════════════════════════════════
@@ -726,18 +807,32 @@ class KelpCOA:
     def _pg_coc(self):
         s = self._hdr("CHAIN OF CUSTODY")
         if self.coc_bytes:
-            im = PILImage.open(io.BytesIO(self.coc_bytes))
-            iw, ih = im.size
-            mw, mh = CW, PH - 2.5*inch
-            sc = min(mw/iw, mh/ih)
-            s.append(Image(self._img_buf(self.coc_bytes), width=iw*sc, height=ih*sc))
+            w, h = self._fit(self._coc_rd, CW, PH - 2.5*inch)
+            s.append(ReaderImage(self._coc_rd, w, h, hAlign='CENTER'))
         else:
             s.append(Spacer(1, 2*inch))
             s.append(Paragraph("(Upload Chain of Custody scan in the application)",
-                               ParagraphStyle('ph', parent=ST['b9'], alignment=TA_CENTER, textColor=MDGRAY)))
+                               ParagraphStyle('ph', parent=self.ST['b9'], alignment=TA_CENTER, textColor=MDGRAY)))
         return s
 
 
+# ─── BATCH BUILD ─────────────────────────────────────────────────────────────
+def _build_one(job):
+    return KelpCOA(*job).build()
+
+def build_many(jobs, max_workers=None):
+    """Build several COAs in parallel worker processes.
+    jobs = [(d, logo_bytes, sig_bytes, coc_bytes), ...] — same arguments as KelpCOA.
+    Returns the PDF bytes in job order."""
+    jobs = list(jobs)
+    if len(jobs) < 2:
+        return [_build_one(j) for j in jobs]
+    # Only batch builds need a process pool; keep it off the app's import path
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as ex:
+        return list(ex.map(_build_one, jobs))
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # KELP ANALYTE CATALOG — Built from KELP CA ELAP Price List
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -800,8 +895,12 @@ KELP_ANALYTE_CATALOG = {
 }
 
 # Flat list of all unique analyte names for freeform selectbox
-ALL_ANALYTES = sorted(set(a for lst in KELP_ANALYTE_CATALOG.values() for a in lst))
-ALL_METHODS  = sorted(KELP_ANALYTE_CATALOG.keys())
+ALL_ANALYTES = tuple(sorted(set(a for lst in KELP_ANALYTE_CATALOG.values() for a in lst)))
+ALL_METHODS  = tuple(sorted(KELP_ANALYTE_CATALOG.keys()))
+
+# Method selectbox options, with catalog method -> selectbox index
+_METHOD_OPTS = ("", *ALL_METHODS, "── Other (type below) ──")
+_METHOD_IDX  = {m: i for i, m in enumerate(ALL_METHODS, 1)}
 
 # Default units per method family
 METHOD_UNITS = {
@@ -820,7 +919,20 @@ METHOD_UNITS = {
 }
 
 # KELP qualifiers (from the Qualifiers & Definitions page)
-KELP_QUALIFIERS = ["","B","D","E","H","J","NA","N/A","ND","NR","R","S","X"]
+KELP_QUALIFIERS = ("","B","D","E","H","J","NA","N/A","ND","NR","R","S","X")
+_QUAL_IDX = {q: i for i, q in enumerate(KELP_QUALIFIERS)}
+
+# Sample matrix choices (samples, MB and LCS batches)
+_MATRICES = ("Water","Soil","Air","Other")
+
+# Receipt checklist answer choices, with value -> selectbox index
+_YES_NO = ("Yes","No","Not Present","N/A")
+_YN_IDX = {v: i for i, v in enumerate(_YES_NO)}
+
+# Relative column widths of the per-row result editors
+_RES_COLS      = (3,2,1,1,1,1,1)
+_PREP_RES_COLS = (2,1.5,0.5,1,1,1,0.5,0.7,1.2,0.5,0.7,1)
+_LCS_RES_COLS  = (2,1,1,1,1,1,1,1,1.2,0.8)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -828,22 +940,22 @@ KELP_QUALIFIERS = ["","B","D","E","H","J","NA","N/A","ND","NR","R","S","X"]
 # ═══════════════════════════════════════════════════════════════════════════════
 def _fmt_date(val, fmt="%m/%d/%Y"):
     """Convert date/datetime to string; pass through strings."""
+    if isinstance(val, str):
+        return val
     if val is None:
         return ""
-    if isinstance(val, datetime):
-        return val.strftime(fmt)
-    if isinstance(val, date):
+    if isinstance(val, date):  # also covers datetime
         return val.strftime(fmt)
     return str(val)
 
 def _fmt_datetime(d_val, t_val, fmt="%m/%d/%Y %H:%M"):
     """Combine a date and time into formatted string."""
-    if d_val is None:
-        return ""
-    if isinstance(d_val, date) and isinstance(t_val, time_type):
-        return datetime.combine(d_val, t_val).strftime(fmt)
     if isinstance(d_val, date):
+        if isinstance(t_val, time_type):
+            return datetime.combine(d_val, t_val).strftime(fmt)
         return d_val.strftime("%m/%d/%Y")
+    if d_val is None:
+        return ""
     return str(d_val)
 
 
@@ -878,16 +990,141 @@ def _safe_time(val):
                 continue
     return None
 
+@st.cache_data(show_spinner=False)
+def _shrink_image(raw, max_w, max_h, fmt="PNG"):
+    """Downscale an uploaded image to fit within max_w x max_h pixels and
+    re-encode it as fmt (PNG, or JPEG for photos/scans).
+    Images already inside the box are returned untouched."""
+    im = PILImage.open(io.BytesIO(raw))
+    if im.width <= max_w and im.height <= max_h:
+        return raw
+    if fmt == "JPEG":
+        im = im.convert("RGB")
+    elif im.mode not in ("RGB", "RGBA", "L", "LA"):
+        im = im.convert("RGBA")
+    im.thumbnail((max_w, max_h), PILImage.LANCZOS)
+    out = io.BytesIO()
+    if fmt == "JPEG":
+        im.save(out, "JPEG", quality=85, optimize=True)
+    else:
+        im.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+@st.cache_data(show_spinner=False, ttl="15m", max_entries=32)
+def _build_pdf(data_json, logo_bytes, sig_bytes, coc_bytes):
+    """Build the COA PDF; memoized on the serialized payload and image bytes,
+    so regenerating with unchanged inputs skips the ReportLab build.
+    Bounded so drafts from long editing sessions don't pile up in memory."""
+    return KelpCOA(json.loads(data_json), logo_bytes, sig_bytes, coc_bytes).build()
+
+# Session fields copied into the PDF payload
+_PAYLOAD_KEYS = ("elap_number","lab_phone_display","report_date","work_order","total_page_count",
+                 "client_contact","client_company","client_address","client_city_state_zip",
+                 "project_name","project_number","num_samples_text",
+                 "approver_name","approver_title","approval_date",
+                 "qc_met","method_blank_corrected","case_narrative_custom",
+                 "has_non_accredited_tests","has_results_outside_cal",
+                 "has_subcontracted","subcontractor_lab","sample_condition_notes",
+                 "samples","mb_batches","lcs_batches","receipt","login_summary")
+
+def _payload_json():
+    """Collect the report inputs from session_state, format dates for print,
+    and serialize to the stable JSON string _build_pdf is keyed on."""
+    data = {}
+    for k in _PAYLOAD_KEYS:
+        v = st.session_state.get(k,'')
+        if isinstance(v, (date, datetime)):
+            v = str(v)
+        elif isinstance(v, (list, dict)):
+            # Date fields below are rewritten in place; keep the
+            # widgets' session_state lists and dicts untouched
+            v = copy.deepcopy(v)
+        data[k] = v
+
+    # Convert date fields to display strings
+    data["date_received_text"] = _fmt_date(st.session_state.date_received)
+
+    # Convert date objects deep inside samples/batches to strings for PDF
+    for samp in data.get("samples", []):
+        samp["date_sampled"] = _fmt_datetime(samp.get("date_sampled"), samp.get("time_sampled"))
+        samp["disposal_date"] = _fmt_date(samp.get("disposal_date"))
+        for pg in samp.get("prep_groups", []):
+            pg["prep_date_time"] = _fmt_datetime(pg.get("prep_date"), pg.get("prep_time"))
+            for pr in pg.get("results", []):
+                pr["analyzed_time"] = _fmt_datetime(pr.get("analyzed_date"), pr.get("analyzed_time"))
+    for mb in data.get("mb_batches", []):
+        mb["prep_date"] = _fmt_date(mb.get("prep_date"))
+        mb["analyzed_date"] = _fmt_date(mb.get("analyzed_date"))
+    for lcs_b in data.get("lcs_batches", []):
+        lcs_b["prep_date"] = _fmt_date(lcs_b.get("prep_date"))
+        lcs_b["analyzed_date"] = _fmt_date(lcs_b.get("analyzed_date"))
+    # Receipt dates
+    rcd = data.get("receipt", {})
+    rcd["date_time_received"] = _fmt_datetime(
+        rcd.get("date_received_receipt"), rcd.get("time_received_receipt"))
+    # Login summary dates
+    ls = data.get("login_summary", {})
+    ls["date_received_login"] = _fmt_date(ls.get("date_received_login"))
+    ls["report_due_date"] = _fmt_date(ls.get("report_due_date"))
+
+    return json.dumps(data, default=str, sort_keys=True)
+
+def _new_upload(f, key):
+    """True once per distinct upload in a file_uploader; its file_id is kept
+    under key so later reruns don't re-read and re-process the same file."""
+    if f is None or st.session_state.get(key) == f.file_id:
+        return False
+    st.session_state[key] = f.file_id
+    return True
+
+# Blank records for the editable lists; each call returns a fresh dict
+def _blank_sample():
+    return {"client_sample_id":"","lab_sample_id":"","matrix":"Water",
+            "date_sampled":None,"time_sampled":None,"sdg":"",
+            "disposal_date":None,"results":[],"prep_groups":[]}
+
+def _blank_result():
+    return {"parameter":"","method":"","df":"1","mdl":"","pql":"","result":"","unit":"mg/L"}
+
+def _blank_prep_group():
+    return {"prep_method":"","prep_batch_id":"","prep_date":None,"prep_time":None,"prep_analyst":"","results":[]}
+
+def _blank_prep_result():
+    return {"parameter":"","method":"","df":"1","mdl":"","pql":"","result":"",
+            "qualifier":"","unit":"mg/L","analyzed_date":None,"analyzed_time":None,
+            "analyst":"","analytical_batch":"","is_accredited":True}
+
+def _blank_batch():
+    """MB or LCS batch header."""
+    return {"prep_method":"","analytical_method":"","prep_date":None,
+            "analyzed_date":None,"prep_batch":"","analytical_batch":"",
+            "matrix":"Water","units":"mg/L","results":[]}
+
+def _blank_mb_result():
+    return {"parameter":"","mdl":"","pql":"","mb_conc":"ND","qualifier":""}
+
+def _blank_lcs_result():
+    return {"parameter":"","mdl":"","pql":"","spike_conc":"","lcs_recovery":"",
+            "lcsd_recovery":"","rpd":"","recovery_limits":"80-120","rpd_limits":"20","qualifier":""}
+
+def _resize(items, n, factory):
+    """Grow items with factory() records or truncate it, in place, to length n."""
+    if len(items) < n:
+        items.extend(factory() for _ in range(n - len(items)))
+    else:
+        del items[n:]
+
 def init_session():
+    today = date.today()
     defaults = {
         "elap_number": "XXXX", "lab_phone_display": "(408) 550-2162",
-        "report_date": date.today(), "work_order": "", "total_page_count": 12,
+        "report_date": today, "work_order": "", "total_page_count": 12,
         "client_contact": "", "client_company": "", "client_address": "",
         "client_city_state_zip": "", "client_phone": "", "client_email": "",
         "project_name": "", "project_number": "", "client_id": "",
-        "num_samples_text": "1", "date_received": date.today(),
+        "num_samples_text": "1", "date_received": today,
         "approver_name": "Ermias L", "approver_title": "Lab Director",
-        "approval_date": date.today(),
+        "approval_date": today,
         "case_narrative_custom": "", "qc_met": True, "method_blank_corrected": False,
         # TNI 5.10.11c — non-accredited test flagging
         "has_non_accredited_tests": False,
@@ -899,7 +1136,7 @@ def init_session():
         "sample_condition_notes": "",
         "samples": [], "mb_batches": [], "lcs_batches": [],
         "receipt": {
-            "date_received_receipt": date.today(), "time_received_receipt": None,
+            "date_received_receipt": today, "time_received_receipt": None,
             "received_by":"","physically_logged_by":"",
             "checklist_completed_by":"","carrier_name":"Client Drop Off",
             "coc_present":"Yes","coc_signed":"Yes","coc_agrees":"Yes",
@@ -911,11 +1148,12 @@ def init_session():
         },
         "login_summary": {
             "client_id_code":"","qc_level":"II","tat_requested":"Standard",
-            "date_received_login": date.today(),
+            "date_received_login": today,
             "report_due_date": None,
             "login_comments":"",
         },
         "logo_bytes": None, "signature_bytes": None, "coc_image_bytes": None,
+        "last_pdf": None, "last_pdf_b64": "", "last_pdf_hash": b"",
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -924,26 +1162,28 @@ def init_session():
 
 def _method_selectbox(container, label, current, key):
     """Selectbox for method with 'Other' freeform fallback."""
-    opts = [""] + ALL_METHODS + ["── Other (type below) ──"]
-    idx = 0
-    if current in ALL_METHODS:
-        idx = ALL_METHODS.index(current) + 1
-    sel = container.selectbox(label, opts, index=idx, key=key)
+    sel = container.selectbox(label, _METHOD_OPTS, index=_METHOD_IDX.get(current, 0), key=key)
     if sel.startswith("──"):
         sel = container.text_input("Custom method", current, key=f"{key}_custom")
     return sel
 
 
+@st.cache_resource(show_spinner=False)
+def _analyte_options():
+    """Per-method analyte selectbox options and value -> index maps, built
+    once and shared across reruns. Key None holds the unfiltered list.
+    Shared objects: treat as read-only."""
+    out = {}
+    for m, names in [(None, ALL_ANALYTES), *KELP_ANALYTE_CATALOG.items()]:
+        opts = ("", *names, "── Other ──")
+        out[m] = (opts, {v: i for i, v in enumerate(opts)})
+    return out
+
 def _analyte_selectbox(container, label, current, method, key):
     """Selectbox for analyte filtered by selected method, with freeform."""
-    if method and method in KELP_ANALYTE_CATALOG:
-        opts = [""] + KELP_ANALYTE_CATALOG[method] + ["── Other ──"]
-    else:
-        opts = [""] + ALL_ANALYTES + ["── Other ──"]
-    idx = 0
-    if current in opts:
-        idx = opts.index(current)
-    sel = container.selectbox(label, opts, index=idx, key=key)
+    by_method = _analyte_options()
+    opts, index_of = by_method.get(method) or by_method[None]
+    sel = container.selectbox(label, opts, index=index_of.get(current, 0), key=key)
     if sel.startswith("──"):
         sel = container.text_input("Custom analyte", current, key=f"{key}_custom")
     return sel
@@ -951,8 +1191,7 @@ def _analyte_selectbox(container, label, current, method, key):
 
 def _qualifier_selectbox(container, label, current, key):
     """Selectbox for data qualifiers."""
-    idx = KELP_QUALIFIERS.index(current) if current in KELP_QUALIFIERS else 0
-    return container.selectbox(label, KELP_QUALIFIERS, index=idx, key=key)
+    return container.selectbox(label, KELP_QUALIFIERS, index=_QUAL_IDX.get(current, 0), key=key)
 
 
 def _unit_for_method(method):
@@ -960,115 +1199,39 @@ def _unit_for_method(method):
     return METHOD_UNITS.get(method, "mg/L")
 
 
-def main():
-    st.set_page_config(page_title="KELP COA Generator", page_icon="🧪", layout="wide")
-
-    st.markdown("""<style>
+_CSS = """<style>
     .stApp { font-family: 'Calibri','Segoe UI',sans-serif; }
     .main-hdr { background: linear-gradient(135deg, #1F4E79 0%, #3A9ABF 100%); padding: 1.5rem 2rem; border-radius: 10px; margin-bottom: 1.5rem; color: white; }
     .main-hdr h1 { color: white; margin: 0; font-size: 1.8rem; }
     .main-hdr p { color: #D6E4F0; margin: 0.3rem 0 0 0; font-size: 0.95rem; }
-    .sec-hdr { background-color: #1F4E79; color: white; padding: 0.5rem 1rem; border-radius: 5px; margin: 1rem 0 0.5rem 0; font-weight: bold; }
     div[data-testid="stSidebar"] { background-color: #f8f9fa; }
     .stButton > button { background: linear-gradient(135deg, #1F4E79, #3A9ABF); color: white; border: none; font-weight: bold; }
-    </style>""", unsafe_allow_html=True)
+    </style>"""
 
-    init_session()
-
-    st.markdown("""<div class="main-hdr">
+_HEADER_HTML = """<div class="main-hdr">
         <h1>🧪 KELP — Certificate of Analysis Generator</h1>
         <p>KETOS Environmental Lab Platform &nbsp;|&nbsp; TNI / ISO 17025 / ELAP Compliant</p>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
-    with st.sidebar:
-        st.markdown("### 📁 File Uploads")
-        logo_file = st.file_uploader("KELP Logo (PNG/JPG)", type=["png","jpg","jpeg"], key="logo_up")
-        if logo_file: st.session_state.logo_bytes = logo_file.read(); st.image(st.session_state.logo_bytes, width=200)
-        sig_file = st.file_uploader("Approver Signature", type=["png","jpg","jpeg"], key="sig_up")
-        if sig_file: st.session_state.signature_bytes = sig_file.read(); st.image(st.session_state.signature_bytes, width=150)
-        coc_file = st.file_uploader("Chain of Custody Scan", type=["png","jpg","jpeg"], key="coc_up")
-        if coc_file: st.session_state.coc_image_bytes = coc_file.read(); st.success("CoC uploaded ✓")
-        st.divider()
-        st.markdown("### ⚙️ Settings")
-        st.session_state.elap_number = st.text_input("ELAP #", st.session_state.elap_number)
-        st.session_state.lab_phone_display = st.text_input("Lab Phone", st.session_state.lab_phone_display)
-
-    tabs = st.tabs(["📋 Report Info", "🧫 Samples & Results", "🔬 QC Data", "📦 Receipt & Login", "📄 Generate COA"])
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # TAB 1: Report Info
-    # ══════════════════════════════════════════════════════════════════════════
-    with tabs[0]:
-        st.markdown('<div class="sec-hdr">Client Information</div>', unsafe_allow_html=True)
-        c1, c2 = st.columns(2)
-        with c1:
-            st.session_state.client_contact = st.text_input("Contact Name", st.session_state.client_contact)
-            st.session_state.client_company = st.text_input("Company", st.session_state.client_company)
-            st.session_state.client_address = st.text_input("Address", st.session_state.client_address)
-            st.session_state.client_city_state_zip = st.text_input("City/State/ZIP", st.session_state.get('client_city_state_zip',''))
-        with c2:
-            st.session_state.project_name = st.text_input("Project Name", st.session_state.project_name)
-            st.session_state.project_number = st.text_input("Project Number", st.session_state.project_number)
-            st.session_state.work_order = st.text_input("Work Order #", st.session_state.work_order)
-            st.session_state.client_id = st.text_input("Client ID", st.session_state.client_id)
-
-        st.markdown('<div class="sec-hdr">Report Details</div>', unsafe_allow_html=True)
-        c3, c4 = st.columns(2)
-        with c3:
-            st.session_state.report_date = st.date_input("Report Date", _safe_date(st.session_state.report_date))
-            st.session_state.num_samples_text = st.text_input("Number of Samples", st.session_state.num_samples_text)
-            st.session_state.date_received = st.date_input("Date Received", _safe_date(st.session_state.date_received))
-        with c4:
-            st.session_state.approver_name = st.text_input("Approver Name", st.session_state.approver_name)
-            st.session_state.approver_title = st.text_input("Approver Title", st.session_state.approver_title)
-            st.session_state.approval_date = st.date_input("Approval Date", _safe_date(st.session_state.approval_date))
-
-        st.markdown('<div class="sec-hdr">Case Narrative & Compliance</div>', unsafe_allow_html=True)
-        st.session_state.qc_met = st.checkbox("All QC met EPA specifications", st.session_state.qc_met)
-        st.session_state.method_blank_corrected = st.checkbox("Results blank corrected", st.session_state.method_blank_corrected)
-        # TNI 5.10.11c — non-accredited test flagging
-        st.session_state.has_non_accredited_tests = st.checkbox(
-            "Report contains non-accredited tests (TNI 5.10.11c)", st.session_state.has_non_accredited_tests,
-            help="If checked, non-accredited tests will be clearly identified on the report.")
-        # TNI 5.10.11d — outside calibration range
-        st.session_state.has_results_outside_cal = st.checkbox(
-            "Results outside calibration range present (TNI 5.10.11d)", st.session_state.has_results_outside_cal,
-            help="Numerical results outside the calibration range will be flagged with 'E' qualifier.")
-        # TNI 4.5.5 — subcontracted work
-        st.session_state.has_subcontracted = st.checkbox(
-            "Work subcontracted to external lab (TNI 4.5.5)", st.session_state.has_subcontracted)
-        if st.session_state.has_subcontracted:
-            st.session_state.subcontractor_lab = st.text_input(
-                "Subcontractor Laboratory Name & ELAP #", st.session_state.subcontractor_lab,
-                placeholder="e.g., ABC Labs, ELAP #1234")
-        # TNI 5.8.7.2 — sample condition deviations
-        st.session_state.sample_condition_notes = st.text_area(
-            "Sample Condition Notes / Deviations (TNI 5.8.7.2)",
-            st.session_state.sample_condition_notes, height=60,
-            help="Document any sample condition issues: damaged containers, improper preservation, exceeded hold times, etc.")
-        st.session_state.case_narrative_custom = st.text_area(
-            "Additional Case Narrative (optional)", st.session_state.case_narrative_custom, height=80)
+_PAGE_HTML = _CSS + "\n" + _HEADER_HTML
 
-    # ══════════════════════════════════════════════════════════════════════════
-    # TAB 2: Samples & Results — with analyte catalog dropdowns
-    # ══════════════════════════════════════════════════════════════════════════
-    with tabs[1]:
-        st.markdown('<div class="sec-hdr">Samples</div>', unsafe_allow_html=True)
-        st.caption("💡 Select a method first — the analyte dropdown filters automatically from the KELP price list catalog.")
-        samples = st.session_state.samples
-        num_s = st.number_input("Number of samples", 0, 50, len(samples), step=1)
-        _empty_samp = {"client_sample_id":"","lab_sample_id":"","matrix":"Water",
-                       "date_sampled":None,"time_sampled":None,"sdg":"",
-                       "disposal_date":None,"results":[],"prep_groups":[]}
-        while len(samples) < num_s: samples.append(copy.deepcopy(_empty_samp))
-        while len(samples) > num_s: samples.pop()
+@st.fragment
+def _samples_tab():
+    """Samples & Results tab. A fragment, so resizing and Apply rerun only this tab."""
+    st.subheader("Samples", divider="blue")
+    st.caption("💡 Select a method first — after **Apply**, the analyte dropdown filters from the KELP price list catalog. "
+               "Edits below are held until Apply, so typing doesn't rerun the whole app.")
+    samples = st.session_state.samples
+    num_s = st.number_input("Number of samples", 0, 50, len(samples), step=1)
+    _resize(samples, num_s, _blank_sample)
 
+    with st.form("samples_edit", border=False):
         for si, samp in enumerate(samples):
             with st.expander(f"🧪 Sample {si+1}: {samp.get('lab_sample_id','(new)')}", expanded=(si==0)):
                 sc = st.columns(3)
                 samp["client_sample_id"]=sc[0].text_input("Client Sample ID",samp.get("client_sample_id",""),key=f"csid_{si}")
                 samp["lab_sample_id"]=sc[0].text_input("Lab Sample ID",samp.get("lab_sample_id",""),key=f"lsid_{si}")
-                samp["matrix"]=sc[1].selectbox("Matrix",["Water","Soil","Air","Other"],key=f"mx_{si}")
+                samp["matrix"]=sc[1].selectbox("Matrix",_MATRICES,key=f"mx_{si}")
                 # Date pickers for sample dates
                 samp["date_sampled"]=sc[1].date_input("Date Sampled", _safe_date(samp.get("date_sampled")), key=f"ds_{si}")
                 samp["time_sampled"]=sc[1].time_input("Time Sampled", _safe_time(samp.get("time_sampled")), key=f"ts_{si}")
@@ -1078,11 +1241,9 @@ def main():
                 # ── Summary Results (Page 3) ──
                 st.markdown("**Summary Results** (Page 3)")
                 nr = st.number_input("# result rows",0,50,len(samp.get("results",[])),key=f"nr_{si}")
-                _empty_r = {"parameter":"","method":"","df":"1","mdl":"","pql":"","result":"","unit":"mg/L"}
-                while len(samp["results"]) < nr: samp["results"].append(copy.deepcopy(_empty_r))
-                while len(samp["results"]) > nr: samp["results"].pop()
+                _resize(samp["results"], nr, _blank_result)
                 for ri, r in enumerate(samp["results"]):
-                    rc = st.columns([3,2,1,1,1,1,1])
+                    rc = st.columns(_RES_COLS)
                     r["method"] = _method_selectbox(rc[1], "Method", r.get("method",""), f"rm_{si}_{ri}")
                     r["parameter"] = _analyte_selectbox(rc[0], "Param", r.get("parameter",""), r["method"], f"rp_{si}_{ri}")
                     r["df"]=rc[2].text_input("DF",r.get("df","1"),key=f"rd_{si}_{ri}")
@@ -1095,9 +1256,7 @@ def main():
                 # ── Detailed Results by Prep Method (Pages 4+) ──
                 st.markdown("**Detailed Results by Prep Method** (Pages 4+)")
                 npg = st.number_input("# Prep groups",0,10,len(samp.get("prep_groups",[])),key=f"npg_{si}")
-                _empty_pg = {"prep_method":"","prep_batch_id":"","prep_date":None,"prep_time":None,"prep_analyst":"","results":[]}
-                while len(samp["prep_groups"]) < npg: samp["prep_groups"].append(copy.deepcopy(_empty_pg))
-                while len(samp["prep_groups"]) > npg: samp["prep_groups"].pop()
+                _resize(samp["prep_groups"], npg, _blank_prep_group)
                 for pi, pg in enumerate(samp["prep_groups"]):
                     st.markdown(f"**Prep Group {pi+1}**")
                     pc = st.columns(5)
@@ -1108,13 +1267,9 @@ def main():
                     pg["prep_analyst"]=pc[4].text_input("Prep Analyst",pg.get("prep_analyst",""),key=f"pa_{si}_{pi}")
 
                     npr = st.number_input("# results",0,50,len(pg.get("results",[])),key=f"npr_{si}_{pi}")
-                    _empty_pr = {"parameter":"","method":"","df":"1","mdl":"","pql":"","result":"",
-                                 "qualifier":"","unit":"mg/L","analyzed_date":None,"analyzed_time":None,
-                                 "analyst":"","analytical_batch":"","is_accredited":True}
-                    while len(pg["results"]) < npr: pg["results"].append(copy.deepcopy(_empty_pr))
-                    while len(pg["results"]) > npr: pg["results"].pop()
+                    _resize(pg["results"], npr, _blank_prep_result)
                     for pri, pr in enumerate(pg["results"]):
-                        prc = st.columns([2,1.5,0.5,1,1,1,0.5,0.7,1.2,0.5,0.7,1])
+                        prc = st.columns(_PREP_RES_COLS)
                         pr["method"] = _method_selectbox(prc[1], "AMethod", pr.get("method",""), f"prm_{si}_{pi}_{pri}")
                         pr["parameter"] = _analyte_selectbox(prc[0], "Param", pr.get("parameter",""), pr["method"], f"prp_{si}_{pi}_{pri}")
                         pr["df"]=prc[2].text_input("DF",pr.get("df","1"),key=f"prd_{si}_{pi}_{pri}")
@@ -1127,19 +1282,17 @@ def main():
                         pr["analyzed_time"]=prc[9].time_input("Time", _safe_time(pr.get("analyzed_time")), key=f"prat_{si}_{pi}_{pri}")
                         pr["analyst"]=prc[10].text_input("By",pr.get("analyst",""),key=f"prby_{si}_{pi}_{pri}")
                         pr["analytical_batch"]=prc[11].text_input("ABatch",pr.get("analytical_batch",""),key=f"prab_{si}_{pi}_{pri}")
+        st.form_submit_button("Apply sample edits")
 
-    # ══════════════════════════════════════════════════════════════════════════
-    # TAB 3: QC Data — with catalog dropdowns and date pickers
-    # ══════════════════════════════════════════════════════════════════════════
-    with tabs[2]:
-        st.markdown('<div class="sec-hdr">Method Blank (MB) Batches</div>', unsafe_allow_html=True)
-        mbs = st.session_state.mb_batches
-        nmb = st.number_input("# MB batches",0,20,len(mbs),key="nmb")
-        _empty_mb = {"prep_method":"","analytical_method":"","prep_date":None,
-                     "analyzed_date":None,"prep_batch":"","analytical_batch":"",
-                     "matrix":"Water","units":"mg/L","results":[]}
-        while len(mbs) < nmb: mbs.append(copy.deepcopy(_empty_mb))
-        while len(mbs) > nmb: mbs.pop()
+
+@st.fragment
+def _qc_tab():
+    """QC Data tab (MB and LCS batches); a fragment like _samples_tab."""
+    st.subheader("Method Blank (MB) Batches", divider="blue")
+    mbs = st.session_state.mb_batches
+    nmb = st.number_input("# MB batches",0,20,len(mbs),key="nmb")
+    _resize(mbs, nmb, _blank_batch)
+    with st.form("mb_edit", border=False):
         for mi, mb in enumerate(mbs):
             with st.expander(f"MB Batch {mi+1}: {mb.get('prep_method','')}"):
                 mc=st.columns(4)
@@ -1150,11 +1303,10 @@ def main():
                 mc2=st.columns(4)
                 mb["prep_batch"]=mc2[0].text_input("Prep Batch",mb.get("prep_batch",""),key=f"mbpb_{mi}")
                 mb["analytical_batch"]=mc2[1].text_input("An. Batch",mb.get("analytical_batch",""),key=f"mbab_{mi}")
-                mb["matrix"]=mc2[2].selectbox("Matrix",["Water","Soil","Air","Other"],key=f"mbmx_{mi}")
+                mb["matrix"]=mc2[2].selectbox("Matrix",_MATRICES,key=f"mbmx_{mi}")
                 mb["units"]=mc2[3].text_input("Units",mb.get("units",_unit_for_method(mb.get("analytical_method",""))),key=f"mbun_{mi}")
                 nmbr=st.number_input("# results",0,50,len(mb.get("results",[])),key=f"nmbr_{mi}")
-                while len(mb["results"]) < nmbr: mb["results"].append({"parameter":"","mdl":"","pql":"","mb_conc":"ND","qualifier":""})
-                while len(mb["results"]) > nmbr: mb["results"].pop()
+                _resize(mb["results"], nmbr, _blank_mb_result)
                 for ri, r in enumerate(mb["results"]):
                     rc=st.columns(5)
                     r["parameter"] = _analyte_selectbox(rc[0], "Param", r.get("parameter",""), mb.get("analytical_method",""), f"mbrp_{mi}_{ri}")
@@ -1162,15 +1314,13 @@ def main():
                     r["pql"]=rc[2].text_input("PQL",r.get("pql",""),key=f"mbrpq_{mi}_{ri}")
                     r["mb_conc"]=rc[3].text_input("MB Conc.",r.get("mb_conc","ND"),key=f"mbrc_{mi}_{ri}")
                     r["qualifier"] = _qualifier_selectbox(rc[4], "Qual", r.get("qualifier",""), f"mbrqu_{mi}_{ri}")
+        st.form_submit_button("Apply MB edits")
 
-        st.markdown('<div class="sec-hdr">LCS/LCSD Batches</div>', unsafe_allow_html=True)
-        lbs = st.session_state.lcs_batches
-        nlcs = st.number_input("# LCS batches",0,20,len(lbs),key="nlcs")
-        _empty_lcs = {"prep_method":"","analytical_method":"","prep_date":None,
-                      "analyzed_date":None,"prep_batch":"","analytical_batch":"",
-                      "matrix":"Water","units":"mg/L","results":[]}
-        while len(lbs) < nlcs: lbs.append(copy.deepcopy(_empty_lcs))
-        while len(lbs) > nlcs: lbs.pop()
+    st.subheader("LCS/LCSD Batches", divider="blue")
+    lbs = st.session_state.lcs_batches
+    nlcs = st.number_input("# LCS batches",0,20,len(lbs),key="nlcs")
+    _resize(lbs, nlcs, _blank_batch)
+    with st.form("lcs_edit", border=False):
         for li, lcs_b in enumerate(lbs):
             with st.expander(f"LCS Batch {li+1}: {lcs_b.get('prep_method','')}"):
                 lc=st.columns(4)
@@ -1181,15 +1331,12 @@ def main():
                 lc2=st.columns(4)
                 lcs_b["prep_batch"]=lc2[0].text_input("Prep Batch",lcs_b.get("prep_batch",""),key=f"lpb_{li}")
                 lcs_b["analytical_batch"]=lc2[1].text_input("An. Batch",lcs_b.get("analytical_batch",""),key=f"lab_{li}")
-                lcs_b["matrix"]=lc2[2].selectbox("Matrix",["Water","Soil","Air","Other"],key=f"lmx_{li}")
+                lcs_b["matrix"]=lc2[2].selectbox("Matrix",_MATRICES,key=f"lmx_{li}")
                 lcs_b["units"]=lc2[3].text_input("Units",lcs_b.get("units",_unit_for_method(lcs_b.get("analytical_method",""))),key=f"lun_{li}")
                 nlr=st.number_input("# results",0,50,len(lcs_b.get("results",[])),key=f"nlr_{li}")
-                _empty_lr = {"parameter":"","mdl":"","pql":"","spike_conc":"","lcs_recovery":"",
-                             "lcsd_recovery":"","rpd":"","recovery_limits":"80-120","rpd_limits":"20","qualifier":""}
-                while len(lcs_b["results"]) < nlr: lcs_b["results"].append(copy.deepcopy(_empty_lr))
-                while len(lcs_b["results"]) > nlr: lcs_b["results"].pop()
+                _resize(lcs_b["results"], nlr, _blank_lcs_result)
                 for ri, r in enumerate(lcs_b["results"]):
-                    rc=st.columns([2,1,1,1,1,1,1,1,1.2,0.8])
+                    rc=st.columns(_LCS_RES_COLS)
                     r["parameter"] = _analyte_selectbox(rc[0], "Param", r.get("parameter",""), lcs_b.get("analytical_method",""), f"lrp_{li}_{ri}")
                     r["mdl"]=rc[1].text_input("MDL",r.get("mdl",""),key=f"lrm_{li}_{ri}")
                     r["pql"]=rc[2].text_input("PQL",r.get("pql",""),key=f"lrpq_{li}_{ri}")
@@ -1200,12 +1347,118 @@ def main():
                     r["recovery_limits"]=rc[7].text_input("RecLim",r.get("recovery_limits","80-120"),key=f"lrrl_{li}_{ri}")
                     r["rpd_limits"]=rc[8].text_input("RPDLim",r.get("rpd_limits","20"),key=f"lrrpl_{li}_{ri}")
                     r["qualifier"] = _qualifier_selectbox(rc[9], "Q", r.get("qualifier",""), f"lrq_{li}_{ri}")
+        st.form_submit_button("Apply LCS edits")
+
+
+def main():
+    st.set_page_config(page_title="KELP COA Generator", page_icon="🧪", layout="wide")
+
+    init_session()
+
+    # Streamlit drops any element a rerun doesn't emit, so the styles and
+    # banner are sent every run -- as one prebuilt markdown element
+    st.markdown(_PAGE_HTML, unsafe_allow_html=True)
+
+    with st.sidebar:
+        st.markdown("### 📁 File Uploads")
+        logo_file = st.file_uploader("KELP Logo (PNG/JPG)", type=["png","jpg","jpeg"], key="logo_up")
+        if _new_upload(logo_file, "_logo_id"):
+            # Largest on-page logo is 1.8" x 0.8"; keep print resolution (300 dpi)
+            st.session_state.logo_bytes = _shrink_image(logo_file.getvalue(), int(1.8*300), int(0.8*300))
+        if logo_file: st.image(st.session_state.logo_bytes, width=200)
+        sig_file = st.file_uploader("Approver Signature", type=["png","jpg","jpeg"], key="sig_up")
+        if _new_upload(sig_file, "_sig_id"):
+            # Signature box is 1.8" x 0.55"; PNG keeps any transparency
+            st.session_state.signature_bytes = _shrink_image(sig_file.getvalue(), int(1.8*300), int(0.55*300))
+        if sig_file: st.image(st.session_state.signature_bytes, width=150)
+        coc_file = st.file_uploader("Chain of Custody Scan", type=["png","jpg","jpeg"], key="coc_up")
+        if _new_upload(coc_file, "_coc_id"):
+            # CoC page fits the scan in CW x (PH - 2.5"); 200 dpi is plenty for a scan
+            st.session_state.coc_image_bytes = _shrink_image(
+                coc_file.getvalue(), int(CW/inch*200), int((PH - 2.5*inch)/inch*200), "JPEG")
+        if coc_file: st.success("CoC uploaded ✓")
+        st.divider()
+        st.markdown("### ⚙️ Settings")
+        st.text_input("ELAP #", key="elap_number")
+        st.text_input("Lab Phone", key="lab_phone_display")
+
+    tabs = st.tabs(["📋 Report Info", "🧫 Samples & Results", "🔬 QC Data", "📦 Receipt & Login", "📄 Generate COA"])
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # TAB 1: Report Info
+    # ══════════════════════════════════════════════════════════════════════════
+    with tabs[0]:
+        # Text fields are batched behind Apply; the compliance checkboxes below
+        # stay live so the subcontractor field can appear as soon as it's ticked
+        with st.form("report_info", border=False):
+            st.subheader("Client Information", divider="blue")
+            c1, c2 = st.columns(2)
+            with c1:
+                st.text_input("Contact Name", key="client_contact")
+                st.text_input("Company", key="client_company")
+                st.text_input("Address", key="client_address")
+                st.text_input("City/State/ZIP", key="client_city_state_zip")
+            with c2:
+                st.text_input("Project Name", key="project_name")
+                st.text_input("Project Number", key="project_number")
+                st.text_input("Work Order #", key="work_order")
+                st.text_input("Client ID", key="client_id")
+
+            st.subheader("Report Details", divider="blue")
+            c3, c4 = st.columns(2)
+            with c3:
+                st.date_input("Report Date", key="report_date")
+                st.text_input("Number of Samples", key="num_samples_text")
+                st.date_input("Date Received", key="date_received")
+            with c4:
+                st.text_input("Approver Name", key="approver_name")
+                st.text_input("Approver Title", key="approver_title")
+                st.date_input("Approval Date", key="approval_date")
+            st.form_submit_button("Apply report info")
+
+        st.subheader("Case Narrative & Compliance", divider="blue")
+        st.checkbox("All QC met EPA specifications", key="qc_met")
+        st.checkbox("Results blank corrected", key="method_blank_corrected")
+        # TNI 5.10.11c — non-accredited test flagging
+        st.checkbox(
+            "Report contains non-accredited tests (TNI 5.10.11c)", key="has_non_accredited_tests",
+            help="If checked, non-accredited tests will be clearly identified on the report.")
+        # TNI 5.10.11d — outside calibration range
+        st.checkbox(
+            "Results outside calibration range present (TNI 5.10.11d)", key="has_results_outside_cal",
+            help="Numerical results outside the calibration range will be flagged with 'E' qualifier.")
+        # TNI 4.5.5 — subcontracted work
+        st.checkbox(
+            "Work subcontracted to external lab (TNI 4.5.5)", key="has_subcontracted")
+        if st.session_state.has_subcontracted:
+            st.text_input(
+                "Subcontractor Laboratory Name & ELAP #", key="subcontractor_lab",
+                placeholder="e.g., ABC Labs, ELAP #1234")
+        # TNI 5.8.7.2 — sample condition deviations
+        st.text_area(
+            "Sample Condition Notes / Deviations (TNI 5.8.7.2)",
+            key="sample_condition_notes", height=60,
+            help="Document any sample condition issues: damaged containers, improper preservation, exceeded hold times, etc.")
+        st.text_area(
+            "Additional Case Narrative (optional)", key="case_narrative_custom", height=80)
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # TAB 2: Samples & Results — with analyte catalog dropdowns
+    # ══════════════════════════════════════════════════════════════════════════
+    with tabs[1]:
+        _samples_tab()
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # TAB 3: QC Data — with catalog dropdowns and date pickers
+    # ══════════════════════════════════════════════════════════════════════════
+    with tabs[2]:
+        _qc_tab()
 
     # ══════════════════════════════════════════════════════════════════════════
     # TAB 4: Receipt & Login — with date/time pickers
     # ══════════════════════════════════════════════════════════════════════════
     with tabs[3]:
-        st.markdown('<div class="sec-hdr">Sample Receipt Checklist</div>', unsafe_allow_html=True)
+        st.subheader("Sample Receipt Checklist", divider="blue")
         rcd = st.session_state.receipt
         rc1, rc2 = st.columns(2)
         with rc1:
@@ -1214,19 +1467,18 @@ def main():
             rcd["received_by"]=st.text_input("Received By",rcd["received_by"],key="rrb")
             rcd["carrier_name"]=st.text_input("Carrier",rcd["carrier_name"],key="rcn")
         with rc2:
-            yn = ["Yes","No","Not Present","N/A"]
-            rcd["coc_present"]=st.selectbox("CoC present?",yn,index=yn.index(rcd.get("coc_present","Yes")),key="rcp")
-            rcd["coc_signed"]=st.selectbox("CoC signed?",yn,index=yn.index(rcd.get("coc_signed","Yes")),key="rcs")
-            rcd["coc_agrees"]=st.selectbox("CoC agrees?",yn,index=yn.index(rcd.get("coc_agrees","Yes")),key="rca")
+            rcd["coc_present"]=st.selectbox("CoC present?",_YES_NO,index=_YN_IDX.get(rcd.get("coc_present"),0),key="rcp")
+            rcd["coc_signed"]=st.selectbox("CoC signed?",_YES_NO,index=_YN_IDX.get(rcd.get("coc_signed"),0),key="rcs")
+            rcd["coc_agrees"]=st.selectbox("CoC agrees?",_YES_NO,index=_YN_IDX.get(rcd.get("coc_agrees"),0),key="rca")
         rc3, rc4 = st.columns(2)
         with rc3:
-            rcd["custody_seals_bottles"]=st.selectbox("Seals on bottles?",yn,index=yn.index(rcd.get("custody_seals_bottles","Not Present")),key="rcsb")
-            rcd["cooler_good"]=st.selectbox("Cooler good?",yn,index=0,key="rcg")
-            rcd["proper_container"]=st.selectbox("Proper containers?",yn,index=0,key="rpc")
-            rcd["containers_intact"]=st.selectbox("Containers intact?",yn,index=0,key="rci")
+            rcd["custody_seals_bottles"]=st.selectbox("Seals on bottles?",_YES_NO,index=_YN_IDX.get(rcd.get("custody_seals_bottles"),2),key="rcsb")
+            rcd["cooler_good"]=st.selectbox("Cooler good?",_YES_NO,index=0,key="rcg")
+            rcd["proper_container"]=st.selectbox("Proper containers?",_YES_NO,index=0,key="rpc")
+            rcd["containers_intact"]=st.selectbox("Containers intact?",_YES_NO,index=0,key="rci")
         with rc4:
-            rcd["sufficient_volume"]=st.selectbox("Sufficient volume?",yn,index=0,key="rsv")
-            rcd["within_holding_time"]=st.selectbox("Within holding time?",yn,index=0,key="rwh")
+            rcd["sufficient_volume"]=st.selectbox("Sufficient volume?",_YES_NO,index=0,key="rsv")
+            rcd["within_holding_time"]=st.selectbox("Within holding time?",_YES_NO,index=0,key="rwh")
             rcd["temp_compliance"]=st.selectbox("Temp compliance?",["Yes","No"],key="rtc")
             rcd["temperature"]=st.text_input("Temperature (°C)",rcd["temperature"],key="rtemp")
         rcd["voa_headspace"]=st.selectbox("VOA headspace?",["No VOA vials submitted","Yes","No"],key="rvoa")
@@ -1234,7 +1486,7 @@ def main():
         rcd["receipt_comments"]=st.text_area("Receipt Comments",rcd["receipt_comments"],key="rcom",height=60)
 
         st.divider()
-        st.markdown('<div class="sec-hdr">Login Summary</div>', unsafe_allow_html=True)
+        st.subheader("Login Summary", divider="blue")
         ls = st.session_state.login_summary
         lc1, lc2 = st.columns(2)
         with lc1:
@@ -1248,9 +1500,9 @@ def main():
     # TAB 5: Generate COA
     # ══════════════════════════════════════════════════════════════════════════
     with tabs[4]:
-        st.markdown('<div class="sec-hdr">Generate COA PDF</div>', unsafe_allow_html=True)
+        st.subheader("Generate COA PDF", divider="blue")
         nsp = len(st.session_state.samples)
-        total_est = 3 + nsp + 5 + 1
+        total_est = 3 + nsp + 5 + (1 if st.session_state.coc_image_bytes else 0)
         st.session_state.total_page_count = total_est
         st.info(f"Estimated pages: **{total_est}**")
 
@@ -1277,66 +1529,42 @@ def main():
                 ("Non-accredited tests flagged (if any)", not st.session_state.has_non_accredited_tests or True),
                 ("Subcontractor identified (if any)", not st.session_state.has_subcontracted or bool(st.session_state.subcontractor_lab)),
             ]
-            for label, ok in checks:
-                st.write(f"{'✅' if ok else '⚠️'} {label}")
+            # One markdown element for the whole list instead of one per item
+            st.markdown("\n\n".join(f"{'✅' if ok else '⚠️'} {label}" for label, ok in checks))
             passed = sum(1 for _,ok in checks if ok)
             st.progress(passed / len(checks), text=f"{passed}/{len(checks)} items complete")
 
         with st.expander("📊 Summary", expanded=True):
-            st.write(f"**WO:** {st.session_state.work_order} | **Client:** {st.session_state.client_company} | **Project:** {st.session_state.project_name}")
-            st.write(f"**Samples:** {nsp} | **MB:** {len(st.session_state.mb_batches)} | **LCS:** {len(st.session_state.lcs_batches)}")
-            st.write(f"**Logo:** {'✅' if st.session_state.logo_bytes else '❌ text'} | **Sig:** {'✅' if st.session_state.signature_bytes else '❌'} | **CoC:** {'✅' if st.session_state.coc_image_bytes else '❌'}")
+            st.markdown(
+                f"**WO:** {st.session_state.work_order} | **Client:** {st.session_state.client_company} | **Project:** {st.session_state.project_name}\n\n"
+                f"**Samples:** {nsp} | **MB:** {len(st.session_state.mb_batches)} | **LCS:** {len(st.session_state.lcs_batches)}\n\n"
+                f"**Logo:** {'✅' if st.session_state.logo_bytes else '❌ text'} | **Sig:** {'✅' if st.session_state.signature_bytes else '❌'} | **CoC:** {'✅' if st.session_state.coc_image_bytes else '❌'}")
 
         if st.button("🖨️  Generate COA PDF", type="primary", use_container_width=True):
             with st.spinner("Generating PDF..."):
-                data = {}
-                for k in ["elap_number","lab_phone_display","report_date","work_order","total_page_count",
-                           "client_contact","client_company","client_address","client_city_state_zip",
-                           "project_name","project_number","num_samples_text",
-                           "approver_name","approver_title","approval_date",
-                           "qc_met","method_blank_corrected","case_narrative_custom",
-                           "has_non_accredited_tests","has_results_outside_cal",
-                           "has_subcontracted","subcontractor_lab","sample_condition_notes",
-                           "samples","mb_batches","lcs_batches","receipt","login_summary"]:
-                    v = st.session_state.get(k,'')
-                    data[k] = str(v) if isinstance(v, (date, datetime)) else v
-
-                # Convert date fields to display strings
-                data["date_received_text"] = _fmt_date(st.session_state.date_received)
-
-                # Convert date objects deep inside samples/batches to strings for PDF
-                for samp in data.get("samples", []):
-                    samp["date_sampled"] = _fmt_datetime(samp.get("date_sampled"), samp.get("time_sampled"))
-                    samp["disposal_date"] = _fmt_date(samp.get("disposal_date"))
-                    for pg in samp.get("prep_groups", []):
-                        pg["prep_date_time"] = _fmt_datetime(pg.get("prep_date"), pg.get("prep_time"))
-                        for pr in pg.get("results", []):
-                            pr["analyzed_time"] = _fmt_datetime(pr.get("analyzed_date"), pr.get("analyzed_time"))
-                for mb in data.get("mb_batches", []):
-                    mb["prep_date"] = _fmt_date(mb.get("prep_date"))
-                    mb["analyzed_date"] = _fmt_date(mb.get("analyzed_date"))
-                for lcs_b in data.get("lcs_batches", []):
-                    lcs_b["prep_date"] = _fmt_date(lcs_b.get("prep_date"))
-                    lcs_b["analyzed_date"] = _fmt_date(lcs_b.get("analyzed_date"))
-                # Receipt dates
-                rcd = data.get("receipt", {})
-                rcd["date_time_received"] = _fmt_datetime(
-                    rcd.get("date_received_receipt"), rcd.get("time_received_receipt"))
-                # Login summary dates
-                ls = data.get("login_summary", {})
-                ls["date_received_login"] = _fmt_date(ls.get("date_received_login"))
-                ls["report_due_date"] = _fmt_date(ls.get("report_due_date"))
-
-                builder = KelpCOA(data, st.session_state.logo_bytes,
-                                  st.session_state.signature_bytes, st.session_state.coc_image_bytes)
-                pdf_bytes = builder.build()
+                pdf_bytes = _build_pdf(_payload_json(), st.session_state.logo_bytes,
+                                       st.session_state.signature_bytes, st.session_state.coc_image_bytes)
+                # Regenerating with unchanged inputs gives the same bytes; keep
+                # the stored copy and its base64 rather than re-encoding
+                h = hashlib.blake2b(pdf_bytes, digest_size=16).digest()
+                if h != st.session_state.last_pdf_hash:
+                    st.session_state.last_pdf = pdf_bytes
+                    st.session_state.last_pdf_b64 = base64.b64encode(pdf_bytes).decode()
+                    st.session_state.last_pdf_hash = h
 
             st.success(f"✅ COA generated — {len(pdf_bytes):,} bytes")
+
+        # Last generated PDF stays available across reruns without rebuilding
+        pdf_bytes = st.session_state.last_pdf
+        if pdf_bytes:
             wo = st.session_state.work_order or "DRAFT"
             fn = f"KELP_COA_{wo}_{date.today().strftime('%Y%m%d')}.pdf"
             st.download_button(f"⬇️ Download {fn}", pdf_bytes, fn, "application/pdf", use_container_width=True)
-            b64 = base64.b64encode(pdf_bytes).decode()
-            st.markdown(f'<iframe src="data:application/pdf;base64,{b64}" width="100%" height="800px"></iframe>', unsafe_allow_html=True)
+            # Inline preview ships the whole PDF (base64, encoded once per build)
+            # with every rerun, so it is only sent while switched on
+            if st.toggle("Show preview", key="show_preview"):
+                b64 = st.session_state.last_pdf_b64
+                st.markdown(f'<iframe src="data:application/pdf;base64,{b64}" width="100%" height="800px"></iframe>', unsafe_allow_html=True)
 
 if __name__ == "__main__":
     main()